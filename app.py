@@ -14,6 +14,75 @@ st.set_page_config(
     layout="wide"
 )
 
+
+@st.cache_data(show_spinner=False)
+def load_input_data(file_bytes):
+    """
+    Reads the uploaded Excel file, cached across reruns.
+    
+    Args:
+        file_bytes (bytes): Contents of the uploaded file
+        
+    Returns:
+        DataFrame: The raw input data
+    """
+    return pd.read_excel(io.BytesIO(file_bytes), engine='calamine')
+
+
+@st.cache_data(show_spinner=False)
+def run_optimization(file_bytes, stock_length, cutting_gap, optimization_method, stock_length_options, optimize_stock_length):
+    """
+    Runs the cutting optimization, cached across reruns so only changed inputs trigger a new solve.
+    
+    Args:
+        file_bytes (bytes): Contents of the uploaded file
+        stock_length (float): Length of standard stock bars
+        cutting_gap (float): Gap required between cuts
+        optimization_method (str): Optimization method passed to optimize_cutting
+        stock_length_options (tuple): Available stock lengths to choose from
+        optimize_stock_length (bool): Whether to optimize the stock length for each pattern
+        
+    Returns:
+        tuple: (result_df, patterns_df, summary_df) - DataFrames with optimization results
+    """
+    input_data = load_input_data(file_bytes)
+    # Only normalizes the columns of this copy (Vietnamese names, numeric types);
+    # the file was already validated before the optimization was started
+    validate_input_excel(input_data)
+    return optimize_cutting(
+        input_data, 
+        stock_length, 
+        cutting_gap,
+        optimization_method=optimization_method,
+        stock_length_options=list(stock_length_options),
+        optimize_stock_length=optimize_stock_length
+    )
+
+
+@st.cache_data(show_spinner=False)
+def create_sample_excel():
+    """
+    Creates the sample input file offered for download, built once and cached across reruns.
+    
+    Returns:
+        bytes: Contents of the sample Excel file
+    """
+    # Create a sample DataFrame
+    sample_data = {
+        'Mã Thanh': ['ALU001', 'ALU001', 'ALU001', 'ALU002', 'ALU002'],
+        'Chiều Dài': [1200, 800, 1500, 2000, 1000],
+        'Số Lượng': [5, 3, 2, 4, 6]
+    }
+    sample_df = pd.DataFrame(sample_data)
+    # Rename columns to match expected input
+    sample_df.columns = ['Profile Code', 'Length', 'Quantity']
+    
+    # Create a sample Excel file in memory
+    sample_output = io.BytesIO()
+    sample_df.to_excel(sample_output, index=False, engine='xlsxwriter')
+    return sample_output.getvalue()
+
+
 # App title and description
 st.title("✂️ Phần Mềm Tối Ưu Cắt Nhôm")
 st.markdown("""
@@ -85,7 +154,8 @@ uploaded_file = st.file_uploader("Tải Lên File Excel", type=["xlsx", "xls"])
 if uploaded_file is not None:
     # Read and validate the uploaded file
     try:
-        input_data = pd.read_excel(uploaded_file)
+        file_bytes = uploaded_file.getvalue()
+        input_data = load_input_data(file_bytes)
         
         # Validate the input data structure
         validation_result, message = validate_input_excel(input_data)
@@ -103,13 +173,13 @@ if uploaded_file is not None:
             with st.spinner("Đang tối ưu hóa mẫu cắt..."):
                 # Start optimization calculation
                 start_time = time.time()
-                result_df, patterns_df, summary_df = optimize_cutting(
-                    input_data, 
+                result_df, patterns_df, summary_df = run_optimization(
+                    file_bytes, 
                     stock_length, 
                     cutting_gap,
-                    optimization_method=optimization_method,
-                    stock_length_options=stock_length_options,
-                    optimize_stock_length=optimize_stock_length
+                    optimization_method,
+                    tuple(stock_length_options),
+                    optimize_stock_length
                 )
                 end_time = time.time()
                 
@@ -130,10 +200,14 @@ if uploaded_file is not None:
                 'Hiệu Suất Tổng Thể', 
                 'Hiệu Suất Trung Bình'
             ]
-            summary_display['Hiệu Suất Tổng Thể'] = summary_display['Hiệu Suất Tổng Thể'].apply(lambda x: f"{x*100:.2f}%")
-            summary_display['Hiệu Suất Trung Bình'] = summary_display['Hiệu Suất Trung Bình'].apply(lambda x: f"{x*100:.2f}%")
+            # Show efficiencies as percentages, formatted by the frontend so the
+            # columns stay numeric and sortable
+            summary_display[['Hiệu Suất Tổng Thể', 'Hiệu Suất Trung Bình']] *= 100
             
-            st.dataframe(summary_display)
+            st.dataframe(summary_display, column_config={
+                'Hiệu Suất Tổng Thể': st.column_config.NumberColumn(format="%.2f%%"),
+                'Hiệu Suất Trung Bình': st.column_config.NumberColumn(format="%.2f%%")
+            })
             
             # Display detailed results
             st.subheader("Mẫu Cắt Chi Tiết")
@@ -150,9 +224,11 @@ if uploaded_file is not None:
                 'Mẫu Cắt', 
                 'Số Mảnh'
             ]
-            patterns_display['Hiệu Suất'] = patterns_display['Hiệu Suất'].apply(lambda x: f"{x*100:.2f}%")
+            patterns_display['Hiệu Suất'] *= 100
             
-            st.dataframe(patterns_display)
+            st.dataframe(patterns_display, column_config={
+                'Hiệu Suất': st.column_config.NumberColumn(format="%.2f%%")
+            })
             
             # Visualize cutting patterns
             st.subheader("Hình Ảnh Mẫu Cắt")
@@ -163,83 +239,74 @@ if uploaded_file is not None:
             # Filter patterns for the selected profile
             profile_patterns = patterns_df[patterns_df['Profile Code'] == selected_profile]
             
-            for idx, row in profile_patterns.iterrows():
-                pattern = row['Cutting Pattern']
-                pattern_parts = pattern.split('+')
-                
-                # Create visualization
-                fig = go.Figure()
-                
-                # Get stock length for this pattern
-                current_stock_length = row['Stock Length']
-                
-                # Draw the full bar
-                fig.add_shape(
-                    type="rect",
-                    x0=0,
-                    y0=0,
-                    x1=current_stock_length,
-                    y1=1,
-                    line=dict(color="LightGrey"),
-                    fillcolor="LightGrey",
-                )
-                
-                # Draw the pieces
-                current_pos = 0
-                for part in pattern_parts:
-                    if part.strip():  # Skip empty parts
-                        part_length = float(part.strip())
-                        if part_length > 0:  # Skip zero-length parts
-                            fig.add_shape(
-                                type="rect",
-                                x0=current_pos,
-                                y0=0,
-                                x1=current_pos + part_length,
-                                y1=1,
-                                line=dict(color="RoyalBlue"),
-                                fillcolor="RoyalBlue",
-                            )
-                            # Add text label
-                            fig.add_annotation(
-                                x=(current_pos + current_pos + part_length) / 2,
-                                y=0.5,
-                                text=f"{part_length}",
-                                showarrow=False,
-                                font=dict(color="white")
-                            )
-                            current_pos += part_length + cutting_gap
-                
-                # Calculate remaining length
-                remaining = current_stock_length - current_pos + cutting_gap  # Add back the last cutting gap
-                if remaining > 0:
-                    fig.add_shape(
-                        type="rect",
-                        x0=current_pos,
-                        y0=0,
-                        x1=current_stock_length,
-                        y1=1,
-                        line=dict(color="Crimson"),
-                        fillcolor="Crimson",
-                    )
-                    # Add text label for remaining
-                    fig.add_annotation(
-                        x=(current_pos + current_stock_length) / 2,
-                        y=0.5,
-                        text=f"Còn lại: {remaining}",
-                        showarrow=False,
-                        font=dict(color="white")
-                    )
-                
-                # Update layout
-                fig.update_layout(
-                    title=f"Thanh #{row['Bar Number']} - Hiệu suất: {row['Efficiency']*100:.2f}% - Chiều dài: {current_stock_length}mm",
-                    xaxis=dict(title="Chiều dài (mm)"),
-                    yaxis=dict(showticklabels=False),
-                    height=150,
-                    margin=dict(l=20, r=20, t=40, b=20),
-                )
-                
-                st.plotly_chart(fig, use_container_width=True)
+            # Parse all cutting patterns once into a padded array of piece lengths
+            pattern_parts = profile_patterns['Cutting Pattern'].str.split('+', expand=True)
+            piece_lengths = pattern_parts.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+            valid = np.nan_to_num(piece_lengths) > 0  # Skip empty and zero-length parts
+            
+            # Each piece starts after the previous pieces and their cutting gaps
+            steps = np.where(valid, piece_lengths + cutting_gap, 0)
+            ends_with_gap = np.cumsum(steps, axis=1)
+            starts = ends_with_gap - steps
+            ends = starts + piece_lengths
+            midpoints = (starts + ends) / 2
+            
+            # The remaining length starts after the last piece and its cutting gap
+            stock_lengths = profile_patterns['Stock Length'].to_numpy(dtype=np.float64)
+            end_positions = ends_with_gap[:, -1]
+            remaining = stock_lengths - end_positions + cutting_gap  # Add back the last cutting gap
+            has_remaining = remaining > 0
+            
+            bar_labels = [
+                f"Thanh #{bar} - {efficiency*100:.2f}% - {length}mm"
+                for bar, efficiency, length in zip(profile_patterns['Bar Number'], profile_patterns['Efficiency'], profile_patterns['Stock Length'])
+            ]
+            
+            # Row of every bar, piece and remaining segment on the y axis
+            rows = np.arange(len(profile_patterns))
+            piece_rows = np.broadcast_to(rows[:, None], piece_lengths.shape)[valid]
+            remaining_rows = rows[has_remaining]
+            
+            piece_x0 = starts[valid]
+            piece_x1 = ends[valid]
+            remaining_x0 = end_positions[has_remaining]
+            remaining_x1 = stock_lengths[has_remaining]
+            
+            # Collect the rectangles of all bars: full bars, pieces and remaining lengths
+            shape_x0 = np.concatenate([np.zeros(len(rows)), piece_x0, remaining_x0])
+            shape_x1 = np.concatenate([stock_lengths, piece_x1, remaining_x1])
+            shape_rows = np.concatenate([rows, piece_rows, remaining_rows])
+            shape_colors = ["LightGrey"] * len(rows) + ["RoyalBlue"] * len(piece_x0) + ["Crimson"] * len(remaining_x0)
+            shapes = [
+                dict(type="rect", x0=x0, x1=x1, y0=row - 0.4, y1=row + 0.4, line=dict(color=color), fillcolor=color, layer="below")
+                for x0, x1, row, color in zip(shape_x0.tolist(), shape_x1.tolist(), shape_rows.tolist(), shape_colors)
+            ]
+            
+            # Label the pieces and remaining lengths with a single text trace
+            label_text = np.concatenate([
+                piece_lengths[valid].astype(str),
+                np.char.add("Còn lại: ", remaining[has_remaining].astype(str))
+            ])
+            fig = go.Figure(go.Scatter(
+                x=np.concatenate([midpoints[valid], (remaining_x0 + remaining_x1) / 2]),
+                y=np.concatenate([piece_rows, remaining_rows]),
+                text=label_text,
+                mode="text",
+                textfont=dict(color="white"),
+                hoverinfo="text",
+            ))
+            
+            # Update layout, adding all shapes at once
+            fig.update_layout(
+                shapes=shapes,
+                xaxis=dict(title="Chiều dài (mm)", range=[0, max(stock_lengths.max(), shape_x1.max())]),
+                yaxis=dict(tickvals=rows, ticktext=bar_labels, range=[len(rows) - 0.5, -0.5]),
+                height=100 + 40 * len(profile_patterns),
+                margin=dict(l=20, r=20, t=40, b=20),
+                showlegend=False,
+            )
+            
+            st.plotly_chart(fig, use_container_width=True)
             
             # Generate downloadable Excel with the results
             output = io.BytesIO()
@@ -260,24 +327,9 @@ if uploaded_file is not None:
 st.subheader("Cần mẫu biểu mẫu?")
 st.markdown("Tải xuống mẫu để xem định dạng yêu cầu:")
 
-# Create a sample DataFrame
-sample_data = {
-    'Mã Thanh': ['ALU001', 'ALU001', 'ALU001', 'ALU002', 'ALU002'],
-    'Chiều Dài': [1200, 800, 1500, 2000, 1000],
-    'Số Lượng': [5, 3, 2, 4, 6]
-}
-sample_df = pd.DataFrame(sample_data)
-# Rename columns to match expected input
-sample_df.columns = ['Profile Code', 'Length', 'Quantity']
-
-# Create a sample Excel file in memory
-sample_output = io.BytesIO()
-sample_df.to_excel(sample_output, index=False)
-sample_output.seek(0)
-
 st.download_button(
     label="Tải Xuống Mẫu Biểu Mẫu",
-    data=sample_output,
+    data=create_sample_excel(),
     file_name="mau_du_lieu_nhap.xlsx",
     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
 )
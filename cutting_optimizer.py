@@ -2,6 +2,511 @@ import pandas as pd
 import numpy as np
 import pulp as pl
 import itertools
+import threading
+from numba import njit, prange
+
+
+# Numba's fallback workqueue threading layer aborts the process when parallel
+# kernels are launched from several threads at once, as concurrent Streamlit
+# sessions do, so parallel sweeps run one at a time
+_PARALLEL_LOCK = threading.Lock()
+
+# Work allowed for column generation in each profile, counted in LP matrix
+# entries over all LP solves (about two seconds), and the number of generated
+# patterns. Work limits rather than time limits keep the cutting plan the same
+# on every run
+_CG_MAX_WORK = 6e6
+# Work charged for each LP solve on top of its matrix entries, for building
+# the model and starting the solver
+_CG_SOLVE_WORK = 5e4
+_CG_MAX_ITERATIONS = 100
+# Branch-and-bound nodes allowed for the integer problem
+_CG_MAX_NODES = 1000
+# Column generation work allowed over all profiles together (about five
+# seconds), split evenly between the profiles
+_CG_TOTAL_WORK = 1.5e7
+# Column generation only runs when the heuristic uses at least this share of
+# its bars more than the lower bound (and at least one bar more)
+_CG_MIN_GAP = 0.01
+# Largest number of knapsack table cells (about three seconds of work) to spend
+# on knapsack packing over all profiles together, split evenly between the
+# profiles
+_KNAPSACK_MAX_CELLS = 3e9
+
+
+@njit(cache=True)
+def _bfd_pack(lengths, stock, gap):
+    """
+    Best-fit decreasing packing of pieces into stock bars.
+    
+    Args:
+        lengths (ndarray): int32 piece lengths in mm, sorted in descending order
+        stock (int): Length of the stock bars in mm
+        gap (int): Gap required between cuts in mm
+        
+    Returns:
+        tuple: (assign, remaining, n_bins) - Bar index of each piece, remaining
+            length of each bar (only the first n_bins entries are used) and
+            the number of bars opened
+    """
+    n = lengths.shape[0]
+    remaining = np.empty(n, dtype=np.int64)
+    assign = np.empty(n, dtype=np.int64)
+    n_bins = 0
+    
+    # Open bars ordered by remaining length, so the tightest bar that still
+    # fits a piece is found with a binary search
+    sorted_remaining = np.empty(n, dtype=np.int64)
+    sorted_bars = np.empty(n, dtype=np.int64)
+    
+    for i in range(n):
+        length = lengths[i]
+        pos = np.searchsorted(sorted_remaining[:n_bins], length)
+        
+        if pos < n_bins:
+            # Add to the bar with the least room left that still fits
+            bar = sorted_bars[pos]
+            remaining[bar] -= length + gap
+            # The bar only gets shorter, so shift it towards the front
+            new_pos = np.searchsorted(sorted_remaining[:pos], remaining[bar])
+            for j in range(pos, new_pos, -1):
+                sorted_remaining[j] = sorted_remaining[j - 1]
+                sorted_bars[j] = sorted_bars[j - 1]
+        else:
+            # If it doesn't fit anywhere, open a new bar
+            bar = n_bins
+            remaining[bar] = stock - length - gap
+            new_pos = np.searchsorted(sorted_remaining[:n_bins], remaining[bar])
+            for j in range(n_bins, new_pos, -1):
+                sorted_remaining[j] = sorted_remaining[j - 1]
+                sorted_bars[j] = sorted_bars[j - 1]
+            n_bins += 1
+        
+        sorted_remaining[new_pos] = remaining[bar]
+        sorted_bars[new_pos] = bar
+        assign[i] = bar
+    
+    return assign, remaining, n_bins
+
+
+@njit(cache=True)
+def _knapsack_buffer(weights, bounds, capacity):
+    """
+    Allocates the choice table for _bounded_knapsack.
+    
+    The table has one row per binary chunk, so it is large enough for any
+    later call with the same weights and capacity and bounds no larger than
+    the given ones.
+    
+    Args:
+        weights (ndarray): int64 weight of one copy of each item
+        bounds (ndarray): int64 maximum number of copies of each item
+        capacity (int): Knapsack capacity
+        
+    Returns:
+        ndarray: Uninitialized bool table of shape (chunks, capacity + 1)
+    """
+    n_chunks = 0
+    for i in range(weights.shape[0]):
+        if weights[i] > capacity:
+            continue
+        left = min(bounds[i], capacity // weights[i])
+        while left > 0:
+            n_chunks += 1
+            left //= 2
+    
+    return np.empty((n_chunks, capacity + 1), dtype=np.bool_)
+
+
+@njit(cache=True)
+def _bounded_knapsack(weights, values, bounds, capacity, taken):
+    """
+    Solves a bounded knapsack problem with integer weights.
+    
+    Each item is split into chunks of 1, 2, 4, ... copies (binary decomposition)
+    so the problem can be solved as a 0/1 knapsack over the chunks.
+    
+    Args:
+        weights (ndarray): int64 weight of one copy of each item
+        values (ndarray): float64 value of one copy of each item
+        bounds (ndarray): int64 maximum number of copies of each item
+        capacity (int): Knapsack capacity
+        taken (ndarray): Choice table from _knapsack_buffer, reused across calls
+        
+    Returns:
+        ndarray: int64 number of copies taken of each item
+    """
+    n_items = weights.shape[0]
+    counts = np.zeros(n_items, dtype=np.int64)
+    
+    # Split every useful item into binary chunks
+    chunk_item = np.empty(64 * n_items, dtype=np.int64)
+    chunk_size = np.empty(64 * n_items, dtype=np.int64)
+    n_chunks = 0
+    for i in range(n_items):
+        if values[i] <= 0 or weights[i] > capacity:
+            continue
+        left = min(bounds[i], capacity // weights[i])
+        size = 1
+        while left > 0:
+            take = min(size, left)
+            chunk_item[n_chunks] = i
+            chunk_size[n_chunks] = take
+            n_chunks += 1
+            left -= take
+            size *= 2
+    
+    # 0/1 knapsack over the chunks, remembering which chunk improved each capacity
+    best = np.zeros(capacity + 1, dtype=np.float64)
+    for k in range(n_chunks):
+        weight = weights[chunk_item[k]] * chunk_size[k]
+        value = values[chunk_item[k]] * chunk_size[k]
+        taken[k, :weight] = False
+        for c in range(capacity, weight - 1, -1):
+            improved = best[c - weight] + value > best[c]
+            if improved:
+                best[c] = best[c - weight] + value
+            taken[k, c] = improved
+    
+    # Walk back through the chunks to recover the chosen copies
+    c = capacity
+    for k in range(n_chunks - 1, -1, -1):
+        if taken[k, c]:
+            counts[chunk_item[k]] += chunk_size[k]
+            c -= weights[chunk_item[k]] * chunk_size[k]
+    
+    return counts
+
+
+@njit(cache=True)
+def _knapsack_pack(lengths, stock, gap):
+    """
+    Packs pieces bar by bar, filling each bar as fully as possible.
+    
+    Pieces of equal length are collapsed into (length, count) pairs and every
+    bar is filled with an exact bounded knapsack over the pieces still left.
+    
+    Args:
+        lengths (ndarray): int32 piece lengths in mm, sorted in descending order
+        stock (int): Length of the stock bars in mm
+        gap (int): Gap required between cuts in mm
+        
+    Returns:
+        tuple: (assign, remaining, n_bins) as returned by _bfd_pack
+    """
+    n = lengths.shape[0]
+    remaining = np.empty(n, dtype=np.int64)
+    assign = np.empty(n, dtype=np.int64)
+    n_bins = 0
+    
+    # Collapse the sorted pieces into unique lengths with their counts
+    uniq = np.empty(n, dtype=np.int64)
+    counts = np.zeros(n, dtype=np.int64)
+    next_piece = np.empty(n, dtype=np.int64)
+    n_types = 0
+    for i in range(n):
+        if n_types == 0 or lengths[i] != uniq[n_types - 1]:
+            uniq[n_types] = lengths[i]
+            next_piece[n_types] = i
+            n_types += 1
+        counts[n_types - 1] += 1
+    uniq = uniq[:n_types]
+    counts = counts[:n_types]
+    
+    # A piece takes its length plus one cutting gap; the last gap may run past the bar end
+    weights = uniq + gap
+    values = uniq.astype(np.float64)
+    capacity = stock + gap
+    # Counts only go down, so one choice table serves every bar
+    taken = _knapsack_buffer(weights, counts, capacity)
+    
+    left = n
+    while left > 0:
+        # Fill the bar with the longest total length of the pieces still left
+        cut = _bounded_knapsack(weights, values, counts, capacity, taken)
+        if cut.sum() == 0:
+            # Nothing fits, so the longest piece left gets a bar of its own
+            for t in range(n_types):
+                if counts[t] > 0:
+                    cut[t] = 1
+                    break
+        
+        used = 0
+        for t in range(n_types):
+            for _ in range(cut[t]):
+                assign[next_piece[t]] = n_bins
+                next_piece[t] += 1
+            used += cut[t] * weights[t]
+            counts[t] -= cut[t]
+            left -= cut[t]
+        remaining[n_bins] = stock - used
+        n_bins += 1
+    
+    return assign, remaining, n_bins
+
+
+def _knapsack_cells(lengths, stocks, gap, bar_counts):
+    """
+    Estimates the work of knapsack packing for each stock length.
+    
+    Args:
+        lengths (ndarray): int32 piece lengths in mm
+        stocks (ndarray): int64 candidate stock lengths in mm
+        gap (int): Gap required between cuts in mm
+        bar_counts (ndarray): Expected number of bars for each stock length
+        
+    Returns:
+        ndarray: Approximate number of knapsack table cells filled for each stock length
+    """
+    uniq, counts = np.unique(lengths, return_counts=True)
+    capacities = stocks + gap
+    # Binary chunks of each length for the first bar; later bars have fewer
+    fits = np.minimum(counts, capacities[:, None] // (uniq.astype(np.int64) + gap))
+    chunks = np.where(fits > 0, np.floor(np.log2(np.maximum(fits, 1))) + 1, 0).sum(axis=1)
+    
+    return chunks * (capacities + 1) * bar_counts / 2
+
+
+@njit(parallel=True, cache=True)
+def _pack_sweep(lengths, stocks, gap, knapsack):
+    """
+    Packs the pieces for every candidate stock length in parallel.
+    
+    Args:
+        lengths (ndarray): int32 piece lengths in mm, sorted in descending order
+        stocks (ndarray): int64 candidate stock lengths in mm
+        gap (int): Gap required between cuts in mm
+        knapsack (bool): Whether to use bar-by-bar knapsack packing, which is
+            much slower, instead of best-fit decreasing
+        
+    Returns:
+        tuple: (assigns, remainings, bin_counts) - One row of packing results per stock length
+    """
+    n_options = stocks.shape[0]
+    n = lengths.shape[0]
+    assigns = np.empty((n_options, n), dtype=np.int64)
+    remainings = np.empty((n_options, n), dtype=np.int64)
+    bin_counts = np.empty(n_options, dtype=np.int64)
+    
+    for k in prange(n_options):
+        if knapsack:
+            assign, remaining, n_bins = _knapsack_pack(lengths, stocks[k], gap)
+        else:
+            assign, remaining, n_bins = _bfd_pack(lengths, stocks[k], gap)
+        assigns[k] = assign
+        remainings[k] = remaining
+        bin_counts[k] = n_bins
+    
+    return assigns, remainings, bin_counts
+
+
+def _master_problem(columns, demand, category):
+    """
+    Builds the cutting stock master problem over the given patterns.
+    
+    Args:
+        columns (list): Patterns as arrays with the number of pieces of each length
+        demand (ndarray): Number of pieces required of each length
+        category (str): Variable category (pl.LpContinuous or pl.LpInteger)
+        
+    Returns:
+        tuple: (problem, variables) - The PuLP problem and the pattern usage variables
+    """
+    problem = pl.LpProblem("cutting_stock", pl.LpMinimize)
+    variables = [pl.LpVariable(f"x_{j}", lowBound=0, cat=category) for j in range(len(columns))]
+    
+    # Minimize the number of bars used
+    problem += pl.lpSum(variables)
+    
+    # Cut at least the required number of pieces of each length
+    for i in range(len(demand)):
+        pieces = pl.LpAffineExpression([(x, int(column[i])) for column, x in zip(columns, variables) if column[i] > 0])
+        problem += pieces >= int(demand[i]), f"demand_{i}"
+    
+    return problem, variables
+
+
+def _expand_usage(columns, usage, demand):
+    """
+    Expands pattern usage counts into one cut list per bar.
+    
+    Args:
+        columns (list): Patterns as arrays with the number of pieces of each length
+        usage (list): Number of bars cut with each pattern
+        demand (ndarray): Number of pieces required of each length
+        
+    Returns:
+        tuple: (bars, left) - Pieces cut from each bar with surplus pieces dropped,
+            and the number of pieces of each length still to cut
+    """
+    left = demand.copy()
+    bars = []
+    for column, count in zip(columns, usage):
+        for _ in range(int(round(count))):
+            cut = np.minimum(column, left)
+            if cut.sum() > 0:
+                bars.append(cut)
+                left -= cut
+    
+    return bars, left
+
+
+def _column_generation(lengths, stock, gap, assign, n_bins, max_iterations=100, max_work=6e6, max_nodes=1000):
+    """
+    Gilmore-Gomory column generation for the cutting stock problem.
+    
+    Solves the LP relaxation over a growing set of patterns, adding the pattern
+    priced by a knapsack over the dual values until none has negative reduced
+    cost. The LP solution is then rounded down with the leftover pieces packed
+    by best-fit decreasing, or the integer problem is solved over the
+    generated patterns if rounding doesn't beat the current solution.
+    
+    Args:
+        lengths (ndarray): int32 piece lengths in mm, sorted in descending order
+        stock (int): Length of the stock bars in mm
+        gap (int): Gap required between cuts in mm
+        assign (ndarray): Bar index of each piece in the solution to improve on
+        n_bins (int): Number of bars in the solution to improve on
+        max_iterations (int): Maximum number of patterns to generate
+        max_work (float): Maximum LP work, in matrix entries plus _CG_SOLVE_WORK
+            per solve, over all LP solves
+        max_nodes (int): Maximum number of branch-and-bound nodes for the integer problem
+        
+    Returns:
+        tuple: (assign, remaining, n_bins) as returned by _bfd_pack, or None if
+            no solution with fewer than n_bins bars was found
+    """
+    # No solution can beat the current one if the total length doesn't allow it
+    if -(-(lengths.sum() + len(lengths) * gap) // (stock + gap)) >= n_bins:
+        return None
+    
+    uniq, demand = np.unique(lengths, return_counts=True)
+    # A piece takes its length plus one cutting gap; the last gap may run past the bar end
+    weights = uniq.astype(np.int64) + gap
+    capacity = stock + gap
+    if weights.max() > capacity:
+        return None
+    
+    # Start from the patterns of the current solution, plus one pattern per
+    # length cutting as many pieces as fit
+    piece_types = np.searchsorted(uniq, lengths)
+    bar_counts = np.zeros((n_bins, len(uniq)), dtype=np.int64)
+    np.add.at(bar_counts, (assign, piece_types), 1)
+    homogeneous = np.diag(np.minimum(demand, capacity // weights))
+    columns = list(np.unique(np.vstack([bar_counts, homogeneous]), axis=0))
+    
+    # Give up if even the first LP solve is over the work budget
+    work = len(uniq) * len(columns) + _CG_SOLVE_WORK
+    if work > max_work:
+        return None
+    
+    taken = _knapsack_buffer(weights, demand, capacity)
+    solver = pl.PULP_CBC_CMD(msg=False)
+    for _ in range(max_iterations):
+        problem, variables = _master_problem(columns, demand, pl.LpContinuous)
+        problem.solve(solver)
+        if problem.status != pl.LpStatusOptimal:
+            return None
+        
+        # Price a new pattern with the dual value of each length
+        duals = np.array([problem.constraints[f"demand_{i}"].pi for i in range(len(uniq))], dtype=np.float64)
+        column = _bounded_knapsack(weights, duals, demand, capacity, taken)
+        value = float(duals @ column)
+        
+        # Lower bound on the LP optimum from the current objective and the best reduced cost
+        objective = pl.value(problem.objective)
+        lower_bound = np.ceil(objective / max(value, 1.0) - 1e-6)
+        
+        # Stop early when the bound shows the current solution can't be beaten
+        if lower_bound >= n_bins:
+            return None
+        
+        # Stop when no pattern has negative reduced cost, when more patterns
+        # can no longer lower the rounded-up LP objective, or when the next LP
+        # solve would go over the work budget
+        next_work = len(uniq) * (len(columns) + 1) + _CG_SOLVE_WORK
+        if value <= 1 + 1e-9 or lower_bound >= np.ceil(objective - 1e-6) or work + next_work > max_work:
+            break
+        columns.append(column)
+        work += next_work
+    
+    # Round the LP solution down and pack the leftover pieces with best-fit decreasing
+    bars, left = _expand_usage(columns, [np.floor(x.varValue + 1e-9) for x in variables], demand)
+    leftover_types = np.repeat(np.arange(len(uniq)), left)[::-1]
+    leftover_assign, _, leftover_bins = _bfd_pack(uniq[leftover_types], stock, gap)
+    for bar in range(leftover_bins):
+        bars.append(np.bincount(leftover_types[leftover_assign == bar], minlength=len(uniq)))
+    
+    # If rounding doesn't beat the current solution, solve the integer problem
+    # over the generated patterns
+    if len(bars) >= n_bins:
+        problem, variables = _master_problem(columns, demand, pl.LpInteger)
+        problem.solve(pl.PULP_CBC_CMD(msg=False, maxNodes=max_nodes))
+        if any(x.varValue is None for x in variables):
+            return None
+        bars, left = _expand_usage(columns, [x.varValue for x in variables], demand)
+        if left.any() or len(bars) >= n_bins:
+            return None
+    
+    # Map the bars back onto the sorted pieces
+    next_piece = np.searchsorted(-lengths, -uniq)
+    assign = np.empty(len(lengths), dtype=np.int64)
+    remaining = np.empty(len(bars), dtype=np.int64)
+    for bar, cut in enumerate(bars):
+        for i in np.flatnonzero(cut):
+            assign[next_piece[i]:next_piece[i] + cut[i]] = bar
+            next_piece[i] += cut[i]
+        remaining[bar] = stock - cut @ weights
+    
+    return assign, remaining, len(bars)
+
+
+def _is_better(optimization_method, bar_count, efficiency, best_bar_count, best_efficiency):
+    """
+    Checks whether a solution beats the best one so far.
+    
+    Args:
+        optimization_method (str): "Tối Ưu Hiệu Suất Cao Nhất" or "Tối Ưu Số Lượng Thanh"
+        bar_count (int): Number of bars used by the solution
+        efficiency (float): Overall efficiency of the solution
+        best_bar_count (int): Number of bars used by the best solution so far
+        best_efficiency (float): Overall efficiency of the best solution so far
+        
+    Returns:
+        bool: Whether the solution is better under the optimization method
+    """
+    if optimization_method == "Tối Ưu Hiệu Suất Cao Nhất":
+        # If optimizing for efficiency, pick the highest efficiency
+        return efficiency > best_efficiency
+    
+    # If optimizing for bar count, pick the lowest count (or highest efficiency if tied)
+    return bar_count < best_bar_count or (bar_count == best_bar_count and efficiency > best_efficiency)
+
+
+def _best_option(optimization_method, bin_counts, stock_lengths, total_length):
+    """
+    Picks the best packing among the candidate stock lengths.
+    
+    Args:
+        optimization_method (str): "Tối Ưu Hiệu Suất Cao Nhất" or "Tối Ưu Số Lượng Thanh"
+        bin_counts (ndarray): Number of bars used with each stock length
+        stock_lengths (list): Candidate stock lengths
+        total_length (float): Total length of the pieces
+        
+    Returns:
+        int: Index of the best stock length
+    """
+    best_k = 0
+    best_bar_count = float('inf')
+    best_efficiency = 0
+    for k, (n_bins, stock) in enumerate(zip(bin_counts, stock_lengths)):
+        efficiency = total_length / (stock * n_bins) if n_bins > 0 else 0
+        if _is_better(optimization_method, n_bins, efficiency, best_bar_count, best_efficiency):
+            best_k = k
+            best_bar_count = n_bins
+            best_efficiency = efficiency
+    
+    return best_k
 
 
 def optimize_cutting(input_data, stock_length, cutting_gap, optimization_method="Tối Ưu Hiệu Suất Cao Nhất", stock_length_options=None, optimize_stock_length=False):
@@ -22,139 +527,173 @@ def optimize_cutting(input_data, stock_length, cutting_gap, optimization_method=
     # Use default stock length if no options provided
     if stock_length_options is None:
         stock_length_options = [stock_length]
+    stock_options = np.asarray(stock_length_options, dtype=np.float64)
+    
+    # The packing kernels work in whole millimeters: stock lengths are rounded
+    # down and the cutting gap up, so every packing stays feasible
+    packing_stocks = np.floor(stock_options + 1e-9).astype(np.int64)
+    packing_gap = int(np.ceil(cutting_gap - 1e-9))
+    
     # Process input data to expand by quantity
-    expanded_data = []
-    for _, row in input_data.iterrows():
-        for i in range(int(row['Quantity'])):
-            expanded_data.append({
-                'Profile Code': row['Profile Code'],
-                'Length': row['Length'],
-                'Item ID': f"{row['Profile Code']}_{i+1}"
-            })
+    quantities = input_data['Quantity'].to_numpy().astype(np.int64)
+    codes = np.repeat(input_data['Profile Code'].to_numpy(), quantities)
+    item_lengths = np.repeat(input_data['Length'].to_numpy(), quantities)
+    
+    # Number the items of each input row from 1 to its quantity
+    row_starts = np.repeat(np.cumsum(quantities) - quantities, quantities)
+    item_numbers = np.arange(len(codes)) - row_starts + 1
+    item_ids = pd.Series(codes).astype(str) + '_' + pd.Series(item_numbers).astype(str)
     
-    expanded_df = pd.DataFrame(expanded_data)
+    expanded_df = pd.DataFrame({
+        'Profile Code': codes,
+        'Length': item_lengths,
+        'Item ID': item_ids
+    })
+    
+    # Every profile gets an even share of the knapsack and column generation
+    # budgets, so the result doesn't depend on the order of the profiles
+    n_profiles = expanded_df['Profile Code'].nunique()
+    profile_knapsack_cells = _KNAPSACK_MAX_CELLS / max(n_profiles, 1)
+    profile_cg_work = min(_CG_MAX_WORK, _CG_TOTAL_WORK / max(n_profiles, 1))
     
     # Process each profile code separately
-    profile_codes = expanded_df['Profile Code'].unique()
     all_patterns = []
     all_summaries = []
     all_results = []
     
-    for profile_code in profile_codes:
-        # Filter data for this profile
-        profile_data = expanded_df[expanded_df['Profile Code'] == profile_code].copy()
+    for profile_code, profile_data in expanded_df.groupby('Profile Code', sort=False):
+        # Get the lengths needed for this profile, sorted in descending order
+        # for better initial heuristic
+        lengths = np.sort(profile_data['Length'].to_numpy())[::-1]
+        # Whole-millimeter copy for the compiled kernels, rounding any fractional
+        # length up so the packing stays feasible
+        packing_lengths = np.ceil(lengths - 1e-9).astype(np.int32)
         
-        # Get the lengths needed for this profile
-        lengths = profile_data['Length'].values
+        total_length = lengths.sum()
         
-        # Sort lengths in descending order for better initial heuristic
-        lengths = np.sort(lengths)[::-1]
+        # Best-fit decreasing for all stock lengths at once
+        with _PARALLEL_LOCK:
+            assigns, _, bin_counts = _pack_sweep(packing_lengths, packing_stocks, packing_gap, False)
+        best_k = _best_option(optimization_method, bin_counts, stock_length_options, total_length)
         
-        # Store best patterns across all stock lengths
-        best_patterns = []
-        best_remaining_lengths = []
-        best_stock_length = stock_length
-        best_efficiency = 0
-        best_bar_count = float('inf')
+        # Fewest bars any solution can use for each stock length, and the
+        # efficiency that would give
+        lower_bounds = -(-(packing_lengths.sum() + len(lengths) * packing_gap) // (packing_stocks + packing_gap))
+        bound_efficiencies = total_length / (stock_options * lower_bounds)
         
-        # Try different stock lengths if optimization is enabled
-        for current_stock_length in stock_length_options:
-            # First-fit decreasing heuristic to generate initial patterns
-            patterns = []
-            remaining_lengths = []
-            
-            for length in lengths:
-                added = False
-                
-                # Try to add to existing patterns
-                for i, remaining in enumerate(remaining_lengths):
-                    if length <= remaining:
-                        # Update the pattern
-                        patterns[i].append(length)
-                        # Update remaining length (subtract length and cutting gap)
-                        remaining_lengths[i] = remaining - length - cutting_gap
-                        added = True
-                        break
-                
-                # If couldn't add to existing patterns, create a new pattern
-                if not added:
-                    patterns.append([length])
-                    remaining_lengths.append(current_stock_length - length - cutting_gap)
+        # Knapsack packing is much slower, so only retry the stock lengths where
+        # best-fit decreasing is above the lower bound and the bound could still
+        # beat the best solution, furthest above the bound first, while the
+        # knapsack work stays within budget
+        best_bar_count = bin_counts[best_k]
+        best_efficiency = total_length / (stock_length_options[best_k] * best_bar_count)
+        retry = np.flatnonzero([
+            bin_counts[k] > lower_bounds[k] and _is_better(optimization_method, lower_bounds[k], bound_efficiencies[k], best_bar_count, best_efficiency)
+            for k in range(len(stock_options))
+        ])
+        retry = retry[np.argsort(lower_bounds[retry] - bin_counts[retry], kind='stable')]
+        knapsack_cells = _knapsack_cells(packing_lengths, packing_stocks[retry], packing_gap, lower_bounds[retry])
+        retry = retry[np.cumsum(knapsack_cells) <= profile_knapsack_cells]
+        if len(retry) > 0:
+            with _PARALLEL_LOCK:
+                knapsack_assigns, _, knapsack_counts = _pack_sweep(packing_lengths, packing_stocks[retry], packing_gap, True)
+            improved = knapsack_counts < bin_counts[retry]
+            assigns[retry[improved]] = knapsack_assigns[improved]
+            bin_counts[retry[improved]] = knapsack_counts[improved]
+            best_k = _best_option(optimization_method, bin_counts, stock_length_options, total_length)
+        
+        # Store best solution across all stock lengths
+        best_assign = assigns[best_k]
+        best_n_bins = bin_counts[best_k]
+        best_stock_length = stock_length_options[best_k]
+        best_bar_count = best_n_bins
+        best_efficiency = total_length / (best_stock_length * best_bar_count)
+        
+        # Try to improve on the heuristic with column generation, only for the
+        # stock length the heuristic picked and its neighbours, longest first,
+        # splitting the work and iteration budget of the profile between them
+        by_length = np.argsort(-stock_options, kind='stable')
+        pos = np.flatnonzero(by_length == best_k)[0]
+        candidates = by_length[max(pos - 1, 0):pos + 2]
+        max_work = profile_cg_work / len(candidates)
+        max_iterations = _CG_MAX_ITERATIONS // len(candidates)
+        
+        for k in candidates:
+            # Skip stock lengths where the heuristic is too close to the lower
+            # bound for column generation to be worth its cost, or whose lower
+            # bound can't beat the best solution found so far
+            if bin_counts[k] - lower_bounds[k] < max(1, _CG_MIN_GAP * bin_counts[k]):
+                continue
+            current_stock_length = stock_length_options[k]
+            if not _is_better(optimization_method, lower_bounds[k], bound_efficiencies[k], best_bar_count, best_efficiency):
+                continue
             
-            # Calculate metrics for this stock length
-            total_used_length = sum(sum(pattern) for pattern in patterns)
-            total_stock_length = current_stock_length * len(patterns)
-            current_efficiency = total_used_length / total_stock_length if total_stock_length > 0 else 0
+            solution = _column_generation(packing_lengths, packing_stocks[k], packing_gap, assigns[k], bin_counts[k], max_iterations, max_work, _CG_MAX_NODES)
+            if solution is None:
+                continue
             
-            # Determine if this is the best solution based on optimization method
-            if optimization_method == "Tối Ưu Hiệu Suất Cao Nhất":
-                # If optimizing for efficiency, pick the highest efficiency
-                if current_efficiency > best_efficiency:
-                    best_patterns = patterns
-                    best_remaining_lengths = remaining_lengths
-                    best_stock_length = current_stock_length
-                    best_efficiency = current_efficiency
-                    best_bar_count = len(patterns)
-            else:  # "Tối Ưu Số Lượng Thanh"
-                # If optimizing for bar count, pick the lowest count (or highest efficiency if tied)
-                if len(patterns) < best_bar_count or (len(patterns) == best_bar_count and current_efficiency > best_efficiency):
-                    best_patterns = patterns
-                    best_remaining_lengths = remaining_lengths
-                    best_stock_length = current_stock_length
-                    best_efficiency = current_efficiency
-                    best_bar_count = len(patterns)
+            assign, _, n_bins = solution
+            current_efficiency = total_length / (current_stock_length * n_bins)
+            if _is_better(optimization_method, n_bins, current_efficiency, best_bar_count, best_efficiency):
+                best_assign = assign
+                best_n_bins = n_bins
+                best_stock_length = current_stock_length
+                best_efficiency = current_efficiency
+                best_bar_count = n_bins
         
         # Use the best solution found
-        patterns = best_patterns
-        remaining_lengths = best_remaining_lengths
         current_stock_length = best_stock_length
+        n_bins = best_n_bins
         
-        # Create patterns DataFrame
-        pattern_data = []
-        bar_number = 1
+        # Used length, piece count and efficiency of every bar, from the actual
+        # rather than the rounded lengths
+        bin_sum = np.bincount(best_assign, weights=lengths, minlength=n_bins)
+        if np.issubdtype(lengths.dtype, np.integer):
+            # bincount always sums as float64, keep integer lengths integer
+            bin_sum = bin_sum.astype(lengths.dtype)
+        pieces_per_bin = np.bincount(best_assign, minlength=n_bins)
+        best_remaining = current_stock_length - bin_sum - pieces_per_bin * cutting_gap
+        efficiencies = bin_sum / current_stock_length
         
-        for pattern, remaining in zip(patterns, remaining_lengths):
-            # Calculate total used length including cutting gaps
-            used_length = current_stock_length - remaining
-            # Calculate efficiency
-            efficiency = (sum(pattern) / current_stock_length)
-            
-            pattern_data.append({
-                'Profile Code': profile_code,
-                'Bar Number': bar_number,
-                'Stock Length': current_stock_length,
-                'Used Length': used_length,
-                'Remaining Length': remaining,
-                'Efficiency': efficiency,
-                'Cutting Pattern': '+'.join(str(p) for p in pattern),
-                'Pieces': len(pattern)
-            })
-            
-            # Update result data for each piece in the pattern
-            for length in pattern:
-                # Find the first unassigned item of this length
-                unassigned_items = profile_data[(profile_data['Length'] == length) & 
-                                       (~profile_data['Item ID'].isin([r.get('Item ID') for r in all_results]))]
-                
-                if not unassigned_items.empty:
-                    item_idx = unassigned_items.index[0]
-                    
-                    all_results.append({
-                        'Profile Code': profile_code,
-                        'Item ID': profile_data.loc[item_idx, 'Item ID'],
-                        'Length': length,
-                        'Bar Number': bar_number
-                    })
-            
-            bar_number += 1
+        # Group the pieces by bar, keeping them in descending order within each bar
+        order = np.argsort(best_assign, kind='stable')
+        bar_lengths = lengths[order]
+        bar_numbers = best_assign[order] + 1
+        
+        # Format the cutting patterns of the chosen solution only
+        patterns = np.split(bar_lengths, np.cumsum(pieces_per_bin)[:-1]) if n_bins > 0 else []
+        pattern_strings = ['+'.join(map(str, pattern.tolist())) for pattern in patterns]
         
-        all_patterns.extend(pattern_data)
+        all_patterns.append(pd.DataFrame({
+            'Profile Code': profile_code,
+            'Bar Number': np.arange(1, n_bins + 1),
+            'Stock Length': current_stock_length,
+            'Used Length': current_stock_length - best_remaining,
+            'Remaining Length': best_remaining,
+            'Efficiency': efficiencies,
+            'Cutting Pattern': pattern_strings,
+            'Pieces': pieces_per_bin
+        }))
+        
+        # Match the pieces to the items of the same length in input order: a
+        # stable sort by length lines up the n-th piece and the n-th item of
+        # every length
+        item_lengths = profile_data['Length'].to_numpy()
+        piece_items = np.empty(len(lengths), dtype=np.int64)
+        piece_items[np.argsort(bar_lengths, kind='stable')] = np.argsort(item_lengths, kind='stable')
+        
+        all_results.append(pd.DataFrame({
+            'Profile Code': profile_code,
+            'Item ID': profile_data['Item ID'].to_numpy()[piece_items],
+            'Length': bar_lengths,
+            'Bar Number': bar_numbers
+        }))
         
         # Create summary for this profile
-        total_bars = len(patterns)
-        total_length_needed = sum(lengths)
-        total_length_used = sum(pattern['Stock Length'] for pattern in pattern_data)
-        avg_efficiency = np.mean([p['Efficiency'] for p in pattern_data])
+        total_bars = n_bins
+        total_length_needed = lengths.sum()
+        total_length_used = current_stock_length * total_bars
+        avg_efficiency = efficiencies.mean()
         
         all_summaries.append({
             'Profile Code': profile_code,
@@ -168,9 +707,9 @@ def optimize_cutting(input_data, stock_length, cutting_gap, optimization_method=
         })
     
     # Convert to DataFrames
-    patterns_df = pd.DataFrame(all_patterns)
+    patterns_df = pd.concat(all_patterns, ignore_index=True) if all_patterns else pd.DataFrame()
     summary_df = pd.DataFrame(all_summaries)
-    result_df = pd.DataFrame(all_results)
+    result_df = pd.concat(all_results, ignore_index=True) if all_results else pd.DataFrame()
     
     # Sort and clean up DataFrames
     if not patterns_df.empty:
@@ -78,8 +78,6 @@ def create_output_excel(output_stream, result_df, patterns_df, summary_df, stock
         'Hiệu Suất Tổng Thể', 
         'Hiệu Suất Trung Bình'
     ]
-    summary_vi['Hiệu Suất Tổng Thể'] = summary_vi['Hiệu Suất Tổng Thể'].apply(lambda x: x)
-    summary_vi['Hiệu Suất Trung Bình'] = summary_vi['Hiệu Suất Trung Bình'].apply(lambda x: x)
     
     patterns_vi = patterns_df.copy()
     patterns_vi.columns = [
@@ -102,7 +100,7 @@ def create_output_excel(output_stream, result_df, patterns_df, summary_df, stock
     ]
     
     # Create Excel writer object
-    with pd.ExcelWriter(output_stream, engine='openpyxl') as writer:
+    with pd.ExcelWriter(output_stream, engine='xlsxwriter') as writer:
         # Add a summary sheet
         summary_vi.to_excel(writer, sheet_name='Tổng Hợp', index=False)
         
@@ -120,33 +118,23 @@ def create_output_excel(output_stream, result_df, patterns_df, summary_df, stock
         params_df.to_excel(writer, sheet_name='Tham Số', index=False)
 
         # Format the sheets
-        workbook = writer.book
-        
         # Format Summary sheet
         worksheet = writer.sheets['Tổng Hợp']
-        worksheet.column_dimensions['A'].width = 15
-        worksheet.column_dimensions['B'].width = 15
-        worksheet.column_dimensions['C'].width = 15
-        worksheet.column_dimensions['D'].width = 22
-        worksheet.column_dimensions['E'].width = 22
-        worksheet.column_dimensions['F'].width = 15
-        worksheet.column_dimensions['G'].width = 20
-        worksheet.column_dimensions['H'].width = 20
+        worksheet.set_column('A:C', 15)
+        worksheet.set_column('D:E', 22)
+        worksheet.set_column('F:F', 15)
+        worksheet.set_column('G:H', 20)
         
         # Format Cutting Patterns sheet
         worksheet = writer.sheets['Mẫu Cắt']
-        worksheet.column_dimensions['A'].width = 15
-        worksheet.column_dimensions['B'].width = 15
-        worksheet.column_dimensions['C'].width = 18
-        worksheet.column_dimensions['D'].width = 18
-        worksheet.column_dimensions['E'].width = 18
-        worksheet.column_dimensions['F'].width = 15
-        worksheet.column_dimensions['G'].width = 40
-        worksheet.column_dimensions['H'].width = 15
+        worksheet.set_column('A:B', 15)
+        worksheet.set_column('C:E', 18)
+        worksheet.set_column('F:F', 15)
+        worksheet.set_column('G:G', 40)
+        worksheet.set_column('H:H', 15)
         
         # Format Piece Assignments sheet
         worksheet = writer.sheets['Chi Tiết Mảnh']
-        worksheet.column_dimensions['A'].width = 15
-        worksheet.column_dimensions['B'].width = 30
-        worksheet.column_dimensions['C'].width = 15
-        worksheet.column_dimensions['D'].width = 15
+        worksheet.set_column('A:A', 15)
+        worksheet.set_column('B:B', 30)
+        worksheet.set_column('C:D', 15)